@@ -2,10 +2,13 @@ from __future__ import annotations
 
 import asyncio
 import atexit
+import functools
 import json
 import logging
 import os
 import sys
+from dataclasses import dataclass
+from typing import NamedTuple
 
 import websockets
 from opentelemetry import propagate, trace
@@ -13,35 +16,43 @@ from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExport
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.trace import INVALID_SPAN
+from websockets.exceptions import ConnectionClosed
 
 from .common import (
     AVAILABLE,
     BOOTING,
-    is_call_result,
-    make_call,
+    dumps_bytes,
+    encode_heartbeat_call,
+    encode_meter_values_call,
+    encode_start_transaction_call,
+    encode_status_notification_call,
+    encode_stop_transaction_call,
     make_clear_charging_profile_call,
-    make_heartbeat_call,
     make_set_charging_profile_call,
-    make_status_notification_call,
-    make_start_transaction_call,
-    make_stop_transaction_call,
-    make_meter_values_call,
+    meter_values_template,
     new_uid,
     parse_call_result_payload,
     parse_message,
+    quick_msg_type,
+    run_event_loop,
+    send_queued_frames,
     SessionState,
+    tune_tcp_socket,
 )
 
 logger = logging.getLogger(__name__)
 
+MAX_FRAME_SIZE = 2**16
 
-def _boot_notification_payload() -> dict[str, str]:
-    return {
-        "chargePointVendor": "RalphCo",
-        "chargePointModel": "RalphModel1",
-        "firmwareVersion": "0.1.0",
-        "meterType": "RalphMeter",
-    }
+
+_BOOT_NOTIFICATION_PAYLOAD = {
+    "chargePointVendor": "RalphCo",
+    "chargePointModel": "RalphModel1",
+    "firmwareVersion": "0.1.0",
+    "meterType": "RalphMeter",
+}
+_BOOT_NOTIFICATION_TEMPLATE = b'[2,"%%b","BootNotification",%b]' % dumps_bytes(_BOOT_NOTIFICATION_PAYLOAD)
 
 
 def setup_tracing() -> None:
@@ -57,30 +68,28 @@ def setup_tracing() -> None:
 
 
 class SpanEventHandler(logging.Handler):
+    def __init__(self, level: int = logging.INFO) -> None:
+        super().__init__(level)
+
     def emit(self, record: logging.LogRecord) -> None:
         span = trace.get_current_span()
-        if span and span.is_recording():
-            span.add_event(
-                "log",
-                {
-                    "log.level": record.levelname,
-                    "log.message": record.getMessage(),
-                    "log.logger": record.name,
-                },
-            )
+        if span is INVALID_SPAN or not span.is_recording():
+            return
+        span.add_event(
+            "log",
+            {
+                "log.level": record.levelname,
+                "log.message": record.getMessage(),
+                "log.logger": record.name,
+            },
+        )
 
 
 def _parse_response(
     label: str,
-    response_text: str,
+    response: object,
     expected_uid: str,
 ) -> tuple[dict[str, object] | None, bool]:
-    logger.info("%s RAW RESPONSE: %s", label, response_text)
-    try:
-        response = parse_message(response_text)
-    except json.JSONDecodeError:
-        logger.error("%s PARSE ERROR: invalid JSON", label)
-        return None, True
     if not isinstance(response, list) or len(response) < 3:
         logger.error("%s PARSE ERROR: response must be a list", label)
         return None, True
@@ -106,22 +115,139 @@ def _parse_response(
     return None, True
 
 
+class BootResult(NamedTuple):
+    status: object
+    interval: int
+
+
+class StartResult(NamedTuple):
+    transaction_id: object
+    id_tag_status: object
+
+
+def _id_tag_status(payload: dict[str, object]) -> object:
+    id_tag_info = payload.get("idTagInfo")
+    return id_tag_info.get("status") if isinstance(id_tag_info, dict) else None
+
+
+def _parse_boot_result(payload: dict[str, object]) -> BootResult:
+    interval = payload.get("interval")
+    if not isinstance(interval, int) or interval <= 0:
+        interval = 10
+    return BootResult(payload.get("status"), interval)
+
+
+def _parse_start_result(payload: dict[str, object]) -> StartResult:
+    return StartResult(payload.get("transactionId"), _id_tag_status(payload))
+
+
+@dataclass(slots=True)
+class _EnergyMeter:
+    value_wh: int
+
+
+class _CallDispatcher:
+    def __init__(self, websocket: websockets.WebSocketClientProtocol) -> None:
+        self._websocket = websocket
+        self._pending: dict[str, tuple[str, asyncio.Future[object]]] = {}
+        self._outbox: asyncio.Queue[bytes] = asyncio.Queue()
+        self._tasks: list[asyncio.Task[None]] = []
+        self._closed: str | None = None
+
+    async def __aenter__(self) -> _CallDispatcher:
+        self._tasks = [
+            asyncio.create_task(self._reader()),
+            asyncio.create_task(self._writer()),
+        ]
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._close("dispatcher closed")
+
+    def send_call(self, label: str, uid: str, frame: bytes) -> asyncio.Future[object]:
+        future = asyncio.get_running_loop().create_future()
+        if self._closed is not None:
+            future.set_exception(ConnectionError(self._closed))
+            return future
+        self._pending[uid] = (label, future)
+        self._outbox.put_nowait(frame)
+        return future
+
+    async def request(self, label: str, uid: str, frame: bytes) -> tuple[dict[str, object] | None, bool]:
+        try:
+            response = await self.send_call(label, uid, frame)
+        except ConnectionError as exc:
+            logger.error("%s FAILED: %s", label, exc)
+            return None, True
+        return _parse_response(label, response, uid)
+
+    def _fail_pending(self, reason: str) -> None:
+        pending, self._pending = self._pending, {}
+        for _, future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(reason))
+
+    def _close(self, reason: str) -> None:
+        # Once either side of the connection is gone, later CALLs fail at once instead of waiting forever.
+        if self._closed is None:
+            self._closed = reason
+        self._fail_pending(reason)
+
+    async def _writer(self) -> None:
+        sock = self._websocket.transport.get_extra_info("socket")
+        try:
+            while True:
+                await send_queued_frames(self._websocket, self._outbox, sock)
+        except ConnectionClosed:
+            self._close("connection closed")
+
+    async def _reader(self) -> None:
+        try:
+            async for response_text in self._websocket:
+                if quick_msg_type(response_text) == 2:
+                    # Server-initiated CALLs are unsupported and must not fail the pending CALLs.
+                    logger.warning("Ignoring server-initiated CALL: %s", response_text)
+                    continue
+                try:
+                    response = parse_message(response_text)
+                except json.JSONDecodeError:
+                    logger.error("PARSE ERROR: invalid JSON: %s", response_text)
+                    self._fail_pending("invalid JSON response")
+                    continue
+                uid = response[1] if isinstance(response, list) and len(response) > 1 else None
+                entry = self._pending.pop(uid, None) if isinstance(uid, str) else None
+                if entry is None:
+                    logger.error("PARSE ERROR: no pending CALL for response %s", response_text)
+                    self._fail_pending("unexpected response")
+                    continue
+                label, future = entry
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("%s RAW RESPONSE: %s", label, response_text)
+                if not future.done():
+                    future.set_result(response)
+        except ConnectionClosed:
+            pass
+        finally:
+            self._close("connection closed")
+
+
 async def _heartbeat_loop(
-    websocket: websockets.WebSocketClientProtocol,
+    dispatcher: _CallDispatcher,
     interval: int,
-    ws_lock: asyncio.Lock,
     error_event: asyncio.Event,
     max_count: int = 3,
 ) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + interval
     for idx in range(max_count):
-        await asyncio.sleep(interval)
-        heartbeat_call = make_heartbeat_call()
-        heartbeat_uid = heartbeat_call[1]
-        async with ws_lock:
-            await websocket.send(json.dumps(heartbeat_call))
-            logger.info("Heartbeat %s sent", idx + 1)
-            heartbeat_response_text = await websocket.recv()
-        _, failed = _parse_response(f"Heartbeat {idx + 1}", heartbeat_response_text, heartbeat_uid)
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+        deadline += interval
+        heartbeat_uid, heartbeat_frame = encode_heartbeat_call()
+        logger.info("Heartbeat %s sent", idx + 1)
+        _, failed = await dispatcher.request(f"Heartbeat {idx + 1}", heartbeat_uid, heartbeat_frame)
         if failed:
             error_event.set()
             return
@@ -129,30 +255,25 @@ async def _heartbeat_loop(
 
 
 async def _meter_values_loop(
-    websocket: websockets.WebSocketClientProtocol,
+    dispatcher: _CallDispatcher,
     interval: int,
-    ws_lock: asyncio.Lock,
     transaction_id: int,
-    energy_state: dict[str, int],
+    energy: _EnergyMeter,
     stop_event: asyncio.Event,
     error_event: asyncio.Event,
 ) -> None:
+    meter_template = meter_values_template(connector_id=1, transaction_id=transaction_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + interval
     while not stop_event.is_set():
-        await asyncio.sleep(interval)
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+        deadline += interval
         if stop_event.is_set():
             return
-        energy_state["value"] += 100
-        meter_call = make_meter_values_call(
-            connector_id=1,
-            transaction_id=transaction_id,
-            energy_wh=energy_state["value"],
-        )
-        meter_uid = meter_call[1]
-        async with ws_lock:
-            await websocket.send(json.dumps(meter_call))
-            logger.info("MeterValues sent (energy_wh=%s)", energy_state["value"])
-            meter_response_text = await websocket.recv()
-        _, failed = _parse_response("MeterValues", meter_response_text, meter_uid)
+        energy.value_wh += 100
+        meter_uid, meter_frame = encode_meter_values_call(meter_template, energy.value_wh)
+        logger.info("MeterValues sent (energy_wh=%s)", energy.value_wh)
+        _, failed = await dispatcher.request("MeterValues", meter_uid, meter_frame)
         if failed:
             error_event.set()
             return
@@ -161,107 +282,103 @@ async def _meter_values_loop(
 
 async def main() -> int:
     setup_tracing()
-    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(levelname)s - %(message)s")
     logger.addHandler(SpanEventHandler())
     state = BOOTING
     host = os.getenv("APP_HOST", "localhost")
     port = int(os.getenv("APP_PORT", "9000"))
     uri = f"ws://{host}:{port}/CP_1"
     uid = new_uid()
-    payload = _boot_notification_payload()
-    message = json.dumps(make_call(uid, "BootNotification", payload))
+    message = _BOOT_NOTIFICATION_TEMPLATE % uid.encode()
     with trace.get_tracer(__name__).start_as_current_span("ws.client") as span:
         try:
             carrier: dict[str, str] = {}
             span.set_attribute("ws.uri", uri)
-            span.set_attribute("ws.message", message)
+            if logger.isEnabledFor(logging.DEBUG):
+                span.set_attribute("ws.message", message.decode())
             propagate.inject(carrier)
+            connect_options = {"compression": None, "max_size": MAX_FRAME_SIZE}
             connect_kwargs = {"additional_headers": carrier}
+            uds_path = os.getenv("UDS_PATH")
+            connect = functools.partial(websockets.unix_connect, uds_path) if uds_path else websockets.connect
             try:
-                connect_ctx = websockets.connect(uri, **connect_kwargs)
+                connect_ctx = connect(uri, **connect_options, **connect_kwargs)
             except TypeError:
-                connect_ctx = websockets.connect(uri, extra_headers=carrier)
+                connect_ctx = connect(uri, extra_headers=carrier, **connect_options)
 
-            async with connect_ctx as websocket:
+            async with connect_ctx as websocket, _CallDispatcher(websocket) as dispatcher:
                 span.set_attribute("ws.connected", True)
-                await websocket.send(message)
-                response_text = await websocket.recv()
-                span.set_attribute("ws.response_text", response_text)
-                boot_payload, failed = _parse_response("BootNotification", response_text, uid)
+                tune_tcp_socket(websocket.transport.get_extra_info("socket"))
+                status_uid, status_frame = encode_status_notification_call(
+                    connector_id=0,
+                    status="Available",
+                    error_code="NoError",
+                )
+                start_uid, start_frame = encode_start_transaction_call(
+                    connector_id=1,
+                    id_tag="TEST",
+                    meter_start=0,
+                )
+                profile_id = 1
+                set_profile_call = make_set_charging_profile_call(
+                    connector_id=1,
+                    profile_id=profile_id,
+                    limit_kw=7.0,
+                )
+                logger.info("BootNotification sent")
+                logger.info("StatusNotification sent (Available)")
+                logger.info("StartTransaction sent (connectorId=1)")
+                logger.info("SetChargingProfile sent (profileId=%s limit_kw=7.0)", profile_id)
+                # Pipelined; the results are still checked in protocol order below.
+                boot_result, status_result, start_result, set_profile_result = await asyncio.gather(
+                    dispatcher.request("BootNotification", uid, message),
+                    dispatcher.request("StatusNotification", status_uid, status_frame),
+                    dispatcher.request("StartTransaction", start_uid, start_frame),
+                    dispatcher.request("SetChargingProfile", set_profile_call[1], dumps_bytes(set_profile_call)),
+                )
+
+                boot_payload, failed = boot_result
                 if failed or boot_payload is None:
                     span.set_attribute("ws.response_status", "Invalid")
                     return 1
-                status = boot_payload.get("status")
-                if status != "Accepted":
-                    logger.error("BootNotification not accepted: %s", status)
+                boot = _parse_boot_result(boot_payload)
+                if boot.status != "Accepted":
+                    logger.error("BootNotification not accepted: %s", boot.status)
                     span.set_attribute("ws.response_status", "Rejected")
                     return 1
 
-                interval = boot_payload.get("interval")
-                if not isinstance(interval, int) or interval <= 0:
-                    interval = 10
+                interval = boot.interval
                 span.set_attribute("ocpp.heartbeat_interval", interval)
                 span.set_attribute("ws.response_status", "Accepted")
                 logger.info("Boot accepted. Heartbeat interval=%s", interval)
 
                 state = AVAILABLE
                 logger.info("State transition: %s -> %s", BOOTING, state)
-                status_call = make_status_notification_call(connector_id=0, status="Available", error_code="NoError")
-                status_uid = status_call[1]
-                await websocket.send(json.dumps(status_call))
-                logger.info("StatusNotification sent (Available)")
-                status_response_text = await websocket.recv()
-                _, failed = _parse_response("StatusNotification", status_response_text, status_uid)
+                _, failed = status_result
                 if failed:
                     return 1
                 logger.info("StatusNotification acknowledged")
 
-                start_call = make_start_transaction_call(
-                    connector_id=1,
-                    id_tag="TEST",
-                    meter_start=0,
-                )
-                start_uid = start_call[1]
-                await websocket.send(json.dumps(start_call))
-                logger.info("StartTransaction sent (connectorId=1)")
-                start_response_text = await websocket.recv()
-                start_payload, failed = _parse_response("StartTransaction", start_response_text, start_uid)
+                start_payload, failed = start_result
                 if failed or start_payload is None:
                     return 1
-                transaction_id = start_payload.get("transactionId")
-                id_tag_info = start_payload.get("idTagInfo", {})
-                if not isinstance(transaction_id, int):
+                start = _parse_start_result(start_payload)
+                if not isinstance(start.transaction_id, int):
                     logger.error("StartTransaction: missing transactionId")
                     return 1
-                if not isinstance(id_tag_info, dict) or id_tag_info.get("status") != "Accepted":
+                if start.id_tag_status != "Accepted":
                     logger.error("StartTransaction not accepted")
                     return 1
                 session = SessionState(
-                    transaction_id=transaction_id,
+                    transaction_id=start.transaction_id,
                     connector_id=1,
                     meter_start=0,
                     meter_stop=0,
                 )
                 logger.info("StartTransaction acknowledged (transactionId=%s)", session.transaction_id)
 
-                ws_lock = asyncio.Lock()
                 error_event = asyncio.Event()
-                profile_id = 1
-                set_profile_call = make_set_charging_profile_call(
-                    connector_id=1,
-                    profile_id=profile_id,
-                    limit_kw=7.0,
-                )
-                set_profile_uid = set_profile_call[1]
-                async with ws_lock:
-                    await websocket.send(json.dumps(set_profile_call))
-                    logger.info("SetChargingProfile sent (profileId=%s limit_kw=7.0)", profile_id)
-                    set_profile_response_text = await websocket.recv()
-                set_profile_payload, failed = _parse_response(
-                    "SetChargingProfile",
-                    set_profile_response_text,
-                    set_profile_uid,
-                )
+                set_profile_payload, failed = set_profile_result
                 if failed or set_profile_payload is None:
                     return 1
                 if set_profile_payload.get("status") != "Accepted":
@@ -270,17 +387,16 @@ async def main() -> int:
                 logger.info("SetChargingProfile acknowledged (profileId=%s)", profile_id)
 
                 heartbeat_task = asyncio.create_task(
-                    _heartbeat_loop(websocket, interval, ws_lock, error_event, max_count=3)
+                    _heartbeat_loop(dispatcher, interval, error_event, max_count=3)
                 )
                 meter_stop_event = asyncio.Event()
-                energy_state = {"value": session.meter_start}
+                energy = _EnergyMeter(value_wh=session.meter_start)
                 meter_task = asyncio.create_task(
                     _meter_values_loop(
-                        websocket,
+                        dispatcher,
                         interval=5,
-                        ws_lock=ws_lock,
                         transaction_id=session.transaction_id,
-                        energy_state=energy_state,
+                        energy=energy,
                         stop_event=meter_stop_event,
                         error_event=error_event,
                     )
@@ -293,15 +409,11 @@ async def main() -> int:
                     return 1
 
                 clear_profile_call = make_clear_charging_profile_call(profile_id=profile_id)
-                clear_profile_uid = clear_profile_call[1]
-                async with ws_lock:
-                    await websocket.send(json.dumps(clear_profile_call))
-                    logger.info("ClearChargingProfile sent (profileId=%s)", profile_id)
-                    clear_profile_response_text = await websocket.recv()
-                clear_profile_payload, failed = _parse_response(
+                logger.info("ClearChargingProfile sent (profileId=%s)", profile_id)
+                clear_profile_payload, failed = await dispatcher.request(
                     "ClearChargingProfile",
-                    clear_profile_response_text,
-                    clear_profile_uid,
+                    clear_profile_call[1],
+                    dumps_bytes(clear_profile_call),
                 )
                 if failed or clear_profile_payload is None:
                     return 1
@@ -310,23 +422,18 @@ async def main() -> int:
                     return 1
                 logger.info("ClearChargingProfile acknowledged (profileId=%s)", profile_id)
 
-                session.meter_stop = energy_state["value"]
-                stop_call = make_stop_transaction_call(
+                session.meter_stop = energy.value_wh
+                stop_uid, stop_frame = encode_stop_transaction_call(
                     transaction_id=session.transaction_id,
                     id_tag="TEST",
                     meter_stop=session.meter_stop,
                     reason="Local",
                 )
-                stop_uid = stop_call[1]
-                async with ws_lock:
-                    await websocket.send(json.dumps(stop_call))
-                    logger.info("StopTransaction sent (transactionId=%s)", session.transaction_id)
-                    stop_response_text = await websocket.recv()
-                stop_payload, failed = _parse_response("StopTransaction", stop_response_text, stop_uid)
+                logger.info("StopTransaction sent (transactionId=%s)", session.transaction_id)
+                stop_payload, failed = await dispatcher.request("StopTransaction", stop_uid, stop_frame)
                 if failed or stop_payload is None:
                     return 1
-                stop_tag_info = stop_payload.get("idTagInfo", {})
-                if not isinstance(stop_tag_info, dict) or stop_tag_info.get("status") != "Accepted":
+                if _id_tag_status(stop_payload) != "Accepted":
                     logger.error("StopTransaction not accepted")
                     return 1
                 logger.info("StopTransaction acknowledged (transactionId=%s)", session.transaction_id)
@@ -341,4 +448,4 @@ async def main() -> int:
 
 
 if __name__ == "__main__":
-    sys.exit(asyncio.run(main()))
+    sys.exit(run_event_loop(main()))
@@ -1,57 +1,89 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import os
+import socket
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any
-from uuid import uuid4
+from typing import Any, Coroutine, Iterator, TypeVar
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+T = TypeVar("T")
 
 BOOTING = "BOOTING"
 AVAILABLE = "AVAILABLE"
 
 
-def make_call(uid: str, action: str, payload: dict[str, Any]) -> list[Any]:
-    return [2, uid, action, payload]
+CallFrame = tuple[int, str, str, dict[str, Any]]
+CallResultFrame = tuple[int, str, dict[str, Any]]
+CallErrorFrame = tuple[int, str, str, str, dict[str, Any]]
+
+
+def make_call(uid: str, action: str, payload: dict[str, Any]) -> CallFrame:
+    return (2, uid, action, payload)
 
 
-def make_call_result(uid: str, payload: dict[str, Any]) -> list[Any]:
-    return [3, uid, payload]
+def make_call_result(uid: str, payload: dict[str, Any]) -> CallResultFrame:
+    return (3, uid, payload)
 
 
-def make_call_error(uid: str, code: str, description: str, details: dict[str, Any] | None = None) -> list[Any]:
-    return [4, uid, code, description, details or {}]
+def make_call_error(uid: str, code: str, description: str, details: dict[str, Any] | None = None) -> CallErrorFrame:
+    return (4, uid, code, description, details or {})
 
 
 def new_uid() -> str:
-    return uuid4().hex
+    return os.urandom(16).hex()
 
 
 def is_call(msg: Any) -> bool:
-    return isinstance(msg, list) and len(msg) == 4 and msg[0] == 2
+    return isinstance(msg, (list, tuple)) and len(msg) == 4 and msg[0] == 2
 
 
 def is_call_result(msg: Any) -> bool:
-    return isinstance(msg, list) and len(msg) >= 3 and msg[0] == 3
+    return isinstance(msg, (list, tuple)) and len(msg) >= 3 and msg[0] == 3
+
+
+class CallFormatError(ValueError):
+    def __init__(self, message: str, uid: str | None = None) -> None:
+        super().__init__(message)
+        self.uid = uid
 
 
 def validate_call(msg: Any) -> tuple[str, str, dict[str, Any]]:
-    if not isinstance(msg, list):
-        raise ValueError("frame must be a JSON list")
+    if not isinstance(msg, (list, tuple)):
+        raise CallFormatError("frame must be a JSON list")
+    uid = msg[1] if len(msg) > 1 and isinstance(msg[1], str) else None
     if len(msg) != 4:
-        raise ValueError("CALL frame must have length 4")
-    message_type, uid, action, payload = msg
+        raise CallFormatError("CALL frame must have length 4", uid)
+    message_type, _, action, payload = msg
     if message_type != 2:
-        raise ValueError("MessageTypeId must be 2 (CALL)")
-    if not isinstance(uid, str) or not uid:
-        raise ValueError("CALL uid must be a non-empty string")
+        raise CallFormatError("MessageTypeId must be 2 (CALL)", uid)
+    if not uid:
+        raise CallFormatError("CALL uid must be a non-empty string", uid)
     if not isinstance(action, str) or not action:
-        raise ValueError("CALL action must be a non-empty string")
+        raise CallFormatError("CALL action must be a non-empty string", uid)
     if not isinstance(payload, dict):
-        raise ValueError("CALL payload must be an object")
+        raise CallFormatError("CALL payload must be an object", uid)
     return uid, action, payload
 
 
-def make_heartbeat_call(uid: str | None = None) -> list[Any]:
+def parse_call(text: str | bytes) -> tuple[str, str, dict[str, Any]]:
+    msg = parse_message(text)
+    if type(msg) is list and len(msg) == 4:
+        message_type, uid, action, payload = msg
+        if message_type == 2 and type(uid) is str and uid and type(action) is str and action and type(payload) is dict:
+            return uid, action, payload
+    return validate_call(msg)
+
+
+def make_heartbeat_call(uid: str | None = None) -> CallFrame:
     return make_call(uid or new_uid(), "Heartbeat", {})
 
 
@@ -60,7 +92,7 @@ def make_status_notification_call(
     connector_id: int = 0,
     status: str = "Available",
     error_code: str = "NoError",
-) -> list[Any]:
+) -> CallFrame:
     payload = {
         "connectorId": connector_id,
         "status": status,
@@ -76,7 +108,7 @@ def make_start_transaction_call(
     id_tag: str = "TEST",
     meter_start: int = 0,
     timestamp: str | None = None,
-) -> list[Any]:
+) -> CallFrame:
     payload = {
         "connectorId": connector_id,
         "idTag": id_tag,
@@ -93,7 +125,7 @@ def make_stop_transaction_call(
     meter_stop: int = 42,
     timestamp: str | None = None,
     reason: str = "Local",
-) -> list[Any]:
+) -> CallFrame:
     payload = {
         "transactionId": transaction_id,
         "meterStop": meter_stop,
@@ -110,7 +142,7 @@ def make_meter_values_call(
     transaction_id: int | None = None,
     energy_wh: int = 0,
     timestamp: str | None = None,
-) -> list[Any]:
+) -> CallFrame:
     entry = {
         "timestamp": timestamp or utc_now_iso_z(),
         "sampledValue": [
@@ -135,7 +167,7 @@ def make_set_charging_profile_call(
     connector_id: int = 1,
     profile_id: int = 1,
     limit_kw: float = 7.0,
-) -> list[Any]:
+) -> CallFrame:
     limit_w = int(limit_kw * 1000)
     charging_profile = {
         "chargingProfileId": profile_id,
@@ -159,13 +191,131 @@ def make_set_charging_profile_call(
     return make_call(uid or new_uid(), "SetChargingProfile", payload)
 
 
-def make_clear_charging_profile_call(uid: str | None = None, profile_id: int | None = None) -> list[Any]:
+def make_clear_charging_profile_call(uid: str | None = None, profile_id: int | None = None) -> CallFrame:
     payload: dict[str, Any] = {}
     if profile_id is not None:
         payload["chargingProfileId"] = profile_id
     return make_call(uid or new_uid(), "ClearChargingProfile", payload)
 
 
+# String fields spliced into these templates must already be JSON-encoded.
+_HEARTBEAT_TEMPLATE = b'[2,%b,"Heartbeat",{}]'
+_STATUS_NOTIFICATION_TEMPLATE = (
+    b'[2,%b,"StatusNotification",{"connectorId":%d,"status":%b,"errorCode":%b,"timestamp":%b}]'
+)
+_START_TRANSACTION_TEMPLATE = (
+    b'[2,%b,"StartTransaction",{"connectorId":%d,"idTag":%b,"meterStart":%d,"timestamp":%b}]'
+)
+_STOP_TRANSACTION_TEMPLATE = (
+    b'[2,%b,"StopTransaction",{"transactionId":%d,"meterStop":%d,"timestamp":%b,"idTag":%b,"reason":%b}]'
+)
+
+
+def _encoded_uid(uid: str | None) -> tuple[str, bytes]:
+    if uid is None:
+        uid = new_uid()
+        # Generated uids are plain hex, so they need no JSON escaping.
+        return uid, b'"%b"' % uid.encode()
+    return uid, dumps_bytes(uid)
+
+
+def _encoded_timestamp(timestamp: str | None) -> bytes:
+    if timestamp is None:
+        return b'"%b"' % utc_now_iso_z().encode()
+    return dumps_bytes(timestamp)
+
+
+def encode_heartbeat_call(uid: str | None = None) -> tuple[str, bytes]:
+    uid, uid_bytes = _encoded_uid(uid)
+    return uid, _HEARTBEAT_TEMPLATE % uid_bytes
+
+
+def encode_status_notification_call(
+    uid: str | None = None,
+    connector_id: int = 0,
+    status: str = "Available",
+    error_code: str = "NoError",
+) -> tuple[str, bytes]:
+    uid, uid_bytes = _encoded_uid(uid)
+    frame = _STATUS_NOTIFICATION_TEMPLATE % (
+        uid_bytes,
+        connector_id,
+        dumps_bytes(status),
+        dumps_bytes(error_code),
+        _encoded_timestamp(None),
+    )
+    return uid, frame
+
+
+def encode_start_transaction_call(
+    uid: str | None = None,
+    connector_id: int = 1,
+    id_tag: str = "TEST",
+    meter_start: int = 0,
+    timestamp: str | None = None,
+) -> tuple[str, bytes]:
+    uid, uid_bytes = _encoded_uid(uid)
+    frame = _START_TRANSACTION_TEMPLATE % (
+        uid_bytes,
+        connector_id,
+        dumps_bytes(id_tag),
+        meter_start,
+        _encoded_timestamp(timestamp),
+    )
+    return uid, frame
+
+
+def encode_stop_transaction_call(
+    uid: str | None = None,
+    transaction_id: int = 0,
+    id_tag: str = "TEST",
+    meter_stop: int = 42,
+    timestamp: str | None = None,
+    reason: str = "Local",
+) -> tuple[str, bytes]:
+    uid, uid_bytes = _encoded_uid(uid)
+    frame = _STOP_TRANSACTION_TEMPLATE % (
+        uid_bytes,
+        transaction_id,
+        meter_stop,
+        _encoded_timestamp(timestamp),
+        dumps_bytes(id_tag),
+        dumps_bytes(reason),
+    )
+    return uid, frame
+
+
+def meter_values_template(connector_id: int = 1, transaction_id: int | None = None) -> bytes:
+    transaction_field = b"" if transaction_id is None else b',"transactionId":%d' % transaction_id
+    return (
+        b'[2,%%b,"MeterValues",{"connectorId":%d,"meterValue":[{"timestamp":%%b,"sampledValue":'
+        b'[{"value":"%%d","measurand":"Energy.Active.Import.Register","unit":"Wh"}]}]%b}]'
+    ) % (connector_id, transaction_field)
+
+
+def encode_meter_values_call(
+    template: bytes,
+    energy_wh: int,
+    uid: str | None = None,
+    timestamp: str | None = None,
+) -> tuple[str, bytes]:
+    uid, uid_bytes = _encoded_uid(uid)
+    return uid, template % (uid_bytes, _encoded_timestamp(timestamp), energy_wh)
+
+
+# Peer uids are always JSON-escaped, unlike the client templates above.
+_EMPTY_RESULT_TEMPLATE = b"[3,%b,{}]"
+_HEARTBEAT_RESULT_TEMPLATE = b'[3,%b,{"currentTime":%b}]'
+
+
+def encode_empty_call_result(uid: str) -> bytes:
+    return _EMPTY_RESULT_TEMPLATE % dumps_bytes(uid)
+
+
+def encode_heartbeat_call_result(uid: str, current_time: str | None = None) -> bytes:
+    return _HEARTBEAT_RESULT_TEMPLATE % (dumps_bytes(uid), _encoded_timestamp(current_time))
+
+
 def is_set_charging_profile(action: str) -> bool:
     return action == "SetChargingProfile"
 
@@ -193,16 +343,53 @@ def get_charging_profile_id(payload: dict[str, Any]) -> int | None:
         return None
 
 
+_TS_CACHE: tuple[int, str] = (-1, "")
+
+
 def utc_now_iso_z() -> str:
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+    # The output has whole-second resolution, so format at most once per second.
+    global _TS_CACHE
+    now = int(time.time())
+    cached = _TS_CACHE
+    if cached[0] == now:
+        return cached[1]
+    text = "%04d-%02d-%02dT%02d:%02d:%02dZ" % time.gmtime(now)[:6]
+    _TS_CACHE = (now, text)
+    return text
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
-def parse_message(text: str) -> Any:
-    return json.loads(text)
+def dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+def parse_message(text: str | bytes) -> Any:
+    if orjson is None:
+        return json.loads(text)
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers keep catching the stdlib type.
+    return orjson.loads(text)
+
+
+def quick_msg_type(frame: str | bytes) -> int:
+    # Peek the MessageTypeId of a compact "[N," frame without decoding it; 0 means "parse to find out".
+    if isinstance(frame, str):
+        if frame[:1] == "[" and frame[2:3] == "," and "0" <= frame[1] <= "9":
+            return ord(frame[1]) - 0x30
+        return 0
+    if frame[:1] == b"[" and frame[2:3] == b"," and 0x30 <= frame[1] <= 0x39:
+        return frame[1] - 0x30
+    return 0
 
 
 def parse_call_result_payload(msg: Any) -> dict[str, Any]:
-    if not isinstance(msg, list) or len(msg) < 3 or msg[0] != 3:
+    if not isinstance(msg, (list, tuple)) or len(msg) < 3 or msg[0] != 3:
         raise ValueError("CALLRESULT frame expected")
     payload = msg[2]
     if not isinstance(payload, dict):
@@ -210,6 +397,45 @@ def parse_call_result_payload(msg: Any) -> dict[str, Any]:
     return payload
 
 
+def tune_tcp_socket(sock: socket.socket | None) -> None:
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if hasattr(socket, "TCP_QUICKACK"):  # Linux only
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+
+@contextmanager
+def corked(sock: socket.socket | None) -> Iterator[None]:
+    if sock is None or not hasattr(socket, "TCP_CORK") or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        yield
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+    try:
+        yield
+    finally:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+
+async def send_queued_frames(websocket: Any, outbox: asyncio.Queue[Any], sock: socket.socket | None) -> None:
+    # Waits for one frame, then sends everything queued behind it; ConnectionClosed propagates.
+    frames = [await outbox.get()]
+    while not outbox.empty():
+        frames.append(outbox.get_nowait())
+    try:
+        # OCPP-J only allows text frames, so encoded bytes go out as TEXT without a str round trip.
+        if len(frames) == 1:
+            await websocket.send(frames[0], text=True)
+            return
+        # Each CALL must stay its own WebSocket message, so coalesce at the TCP layer instead.
+        with corked(sock):
+            for frame in frames:
+                await websocket.send(frame, text=True)
+    finally:
+        for _ in frames:
+            outbox.task_done()
+
+
 def coerce_int(value: Any, field_name: str) -> int:
     try:
         return int(value)
@@ -220,6 +446,35 @@ def coerce_int(value: Any, field_name: str) -> int:
 def parse_iso_z(text: Any, field_name: str) -> datetime:
     if not isinstance(text, str) or not text:
         raise ValueError(f"{field_name} must be a string")
+    if (
+        len(text) == 20
+        and text[19] == "Z"
+        and text[4] == "-"
+        and text[7] == "-"
+        and text[10] == "T"
+        and text[13] == ":"
+        and text[16] == ":"
+        # int() would also take signs, spaces, underscores and non-ASCII digits.
+        and text.isascii()
+        and text[0:4].isdigit()
+        and text[5:7].isdigit()
+        and text[8:10].isdigit()
+        and text[11:13].isdigit()
+        and text[14:16].isdigit()
+        and text[17:19].isdigit()
+    ):
+        try:
+            return datetime(
+                int(text[0:4]),
+                int(text[5:7]),
+                int(text[8:10]),
+                int(text[11:13]),
+                int(text[14:16]),
+                int(text[17:19]),
+                tzinfo=timezone.utc,
+            )
+        except ValueError as exc:
+            raise ValueError(f"{field_name} must be ISO-8601") from exc
     normalized = text.replace("Z", "+00:00")
     try:
         return datetime.fromisoformat(normalized)
@@ -233,3 +488,11 @@ class SessionState:
     connector_id: int
     meter_start: int
     meter_stop: int
+
+
+def run_event_loop(main: Coroutine[Any, Any, T]) -> T:
+    try:
+        import uvloop
+    except ImportError:  # uvloop is POSIX-only; fall back to the stdlib loop
+        return asyncio.run(main)
+    return uvloop.run(main)
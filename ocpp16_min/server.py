@@ -4,11 +4,19 @@ import asyncio
 import atexit
 import json
 import logging
+import multiprocessing
 import os
+import signal
+import sys
+import time
+from contextlib import AbstractContextManager, nullcontext
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from typing import Callable
 
+import fastjsonschema
 import websockets
 from opentelemetry import propagate, trace
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
@@ -19,36 +27,60 @@ from websockets.exceptions import ConnectionClosed
 
 try:
     from .common import (
+        CallFormatError,
         coerce_int,
+        dumps_bytes,
+        encode_empty_call_result,
+        encode_heartbeat_call_result,
         get_charging_profile_id,
         make_call_error,
-        make_call_result,
+        parse_call,
         parse_iso_z,
-        parse_message,
+        run_event_loop,
+        send_queued_frames,
+        tune_tcp_socket,
         utc_now_iso_z,
-        validate_call,
     )
 except ImportError:  # Allows running as a script without -m
     from common import (
+        CallFormatError,
         coerce_int,
+        dumps_bytes,
+        encode_empty_call_result,
+        encode_heartbeat_call_result,
         get_charging_profile_id,
         make_call_error,
-        make_call_result,
+        parse_call,
         parse_iso_z,
-        parse_message,
+        run_event_loop,
+        send_queued_frames,
+        tune_tcp_socket,
         utc_now_iso_z,
-        validate_call,
     )
 
-CALL = 2
-CALL_RESULT = 3
-CALL_ERROR = 4
 HEARTBEAT_INTERVAL_SECONDS = 10
+OUTBOX_MAX_FRAMES = 64
+MAX_FRAME_SIZE = 2**16
+_TRACING_ENABLED = os.getenv("OTEL_SDK_DISABLED", "").strip().lower() != "true"
+
+_BOOT_RESULT_TEMPLATE = (
+    b'[3,%%b,{"status":"Accepted","currentTime":%%b,"interval":%d}]' % HEARTBEAT_INTERVAL_SECONDS
+)
+_START_TRANSACTION_RESULT_TEMPLATE = b'[3,%b,{"transactionId":%d,"idTagInfo":{"status":"Accepted"}}]'
+_ID_TAG_ACCEPTED_RESULT_TEMPLATE = b'[3,%b,{"idTagInfo":{"status":"Accepted"}}]'
+_ACCEPTED_RESULT_TEMPLATE = b'[3,%b,{"status":"Accepted"}]'
+_CALL_ERROR_TEMPLATES = {
+    code: b'[4,%%b,"%b",%%b,{}]' % code.encode()
+    for code in ("FormationViolation", "NotSupported", "PropertyConstraintViolation")
+}
 
 _next_transaction_id = 1
+# Workers stride their ids (worker i hands out i+1, i+1+N, ...) so they stay unique across processes.
+_transaction_id_step = 1
+_exit_callbacks: list[Callable[[], object]] = []
 
 
-@dataclass
+@dataclass(slots=True)
 class ChargePointSession:
     connected: bool = False
     connected_at: datetime | None = None
@@ -65,35 +97,112 @@ class ChargePointSession:
     charging_profiles: dict[int, dict] = field(default_factory=dict)
 
 
-logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+class _UTCFormatter(logging.Formatter):
+    converter = time.gmtime
+
+
+class _FlushingQueueListener(QueueListener):
+    # Flushes handlers only when the queue runs dry, so a burst reaches the fd in one write().
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block)
+
+    def stop(self) -> None:
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+class _FdHandler(logging.Handler):
+    def __init__(self, fd: int, limit: int = 65536) -> None:
+        super().__init__()
+        self.fd = fd
+        self.limit = limit
+        self.buffer = bytearray()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.buffer += (self.format(record) + "\n").encode("utf-8", "replace")
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.limit:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            try:
+                while self.buffer:
+                    del self.buffer[: os.write(self.fd, self.buffer)]
+            except OSError:
+                # Nowhere left to report to (e.g. the reader closed the pipe); drop what is pending.
+                self.buffer.clear()
+
+
 logger = logging.getLogger(__name__)
 raw_logger = logging.getLogger("ocpp.raw")
 tracer = trace.get_tracer(__name__)
 
 _sessions: dict[str, ChargePointSession] = {}
+# DUMP_STATE entries per charge point, kept current by the handlers that change them.
+_state_summary_cache: dict[str, dict[str, object]] = {}
+
+
+def _register_exit(callback: Callable[[], object]) -> None:
+    atexit.register(callback)
+    _exit_callbacks.append(callback)
 
 
 def setup_tracing() -> None:
+    if not _TRACING_ENABLED:
+        return
     service_name = os.getenv("OTEL_SERVICE_NAME", "ocpp16-server")
     endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4317")
 
     resource = Resource.create({"service.name": service_name})
     provider = TracerProvider(resource=resource)
     exporter = OTLPSpanExporter(endpoint=endpoint)
-    provider.add_span_processor(BatchSpanProcessor(exporter))
+    provider.add_span_processor(
+        BatchSpanProcessor(
+            exporter,
+            max_queue_size=int(os.getenv("OTEL_BSP_MAX_QUEUE_SIZE", "4096")),
+            schedule_delay_millis=int(os.getenv("OTEL_BSP_SCHEDULE_DELAY", "1000")),
+            max_export_batch_size=int(os.getenv("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", "256")),
+            export_timeout_millis=int(os.getenv("OTEL_BSP_EXPORT_TIMEOUT", "10000")),
+        )
+    )
     trace.set_tracer_provider(provider)
-    atexit.register(provider.shutdown)
+    _register_exit(provider.shutdown)
+
 
+def setup_console_logging() -> None:
+    handler = _FdHandler(sys.stderr.fileno())
+    handler.setFormatter(_UTCFormatter("%(asctime)s %(levelname)s - %(message)s", "%Y-%m-%dT%H:%M:%SZ"))
+    queue: SimpleQueue[logging.LogRecord] = SimpleQueue()
+    listener = _FlushingQueueListener(queue, handler, respect_handler_level=True)
+    listener.start()
+    _register_exit(listener.stop)
+    queue_handler = QueueHandler(queue)
+    # Only the message is rendered before enqueueing; the listener's handler adds the prefix.
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[queue_handler])
 
-def setup_raw_logging() -> None:
+
+def setup_raw_logging(path: str = "logs/ocpp_raw.log") -> None:
     if raw_logger.handlers:
         return
-    os.makedirs("logs", exist_ok=True)
-    handler = RotatingFileHandler("logs/ocpp_raw.log", maxBytes=1_000_000, backupCount=3)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=1_000_000, backupCount=3)
     formatter = logging.Formatter("%(asctime)s %(message)s")
     handler.setFormatter(formatter)
+    queue: SimpleQueue[logging.LogRecord] = SimpleQueue()
+    listener = QueueListener(queue, handler)
+    listener.start()
+    _register_exit(listener.stop)
     raw_logger.setLevel(logging.INFO)
-    raw_logger.addHandler(handler)
+    raw_logger.addHandler(QueueHandler(queue))
     raw_logger.propagate = False
 
 
@@ -124,12 +233,30 @@ def _now() -> datetime:
 def _get_session(charge_point_id: str) -> ChargePointSession:
     session = _sessions.get(charge_point_id)
     if session is None:
-        session = ChargePointSession()
-        _sessions[charge_point_id] = session
+        session = _sessions[charge_point_id] = ChargePointSession()
+        _state_summary_cache[charge_point_id] = {
+            "chargePointId": charge_point_id,
+            "boot_accepted": session.boot_accepted,
+            "active_transaction_id": session.active_transaction_id,
+            "last_seen_at": None,
+            "last_meter_wh": session.last_meter_wh,
+            "charging_profiles": [],
+        }
     return session
 
 
-def _raw_log(direction: str, charge_point_id: str, text: str) -> None:
+def _profile_summaries(session: ChargePointSession) -> list[dict[str, object]]:
+    return [
+        {"id": profile_id, "limit_w": profile_data.get("limit_w")}
+        for profile_id, profile_data in session.charging_profiles.items()
+    ]
+
+
+def _raw_log(direction: str, charge_point_id: str, text: str | bytes) -> None:
+    if not raw_logger.isEnabledFor(logging.INFO):
+        return
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", "replace")
     raw_logger.info("%s %s %s", charge_point_id, direction, text)
 
 
@@ -140,11 +267,11 @@ def _compact_log(
     uid: str,
     summary: dict[str, object] | None = None,
 ) -> None:
-    ts = utc_now_iso_z()
+    if not logger.isEnabledFor(logging.INFO):
+        return
     compact = summary or {}
     logger.info(
-        "%s cp=%s dir=%s action=%s uid=%s summary=%s",
-        ts,
+        "cp=%s dir=%s action=%s uid=%s summary=%s",
         charge_point_id,
         direction,
         action,
@@ -153,203 +280,490 @@ def _compact_log(
     )
 
 
-def _summary_for(action: str, payload: dict[str, object]) -> dict[str, object]:
-    if action == "BootNotification":
-        return {
-            "vendor": payload.get("chargePointVendor"),
-            "model": payload.get("chargePointModel"),
-        }
-    if action == "Heartbeat":
-        return {}
-    if action == "StatusNotification":
-        return {
-            "connectorId": payload.get("connectorId"),
-            "status": payload.get("status"),
-            "errorCode": payload.get("errorCode"),
-        }
-    if action == "StartTransaction":
-        return {
-            "connectorId": payload.get("connectorId"),
-            "idTag": payload.get("idTag"),
-            "meterStart": payload.get("meterStart"),
-        }
-    if action == "StopTransaction":
-        return {
-            "transactionId": payload.get("transactionId"),
-            "meterStop": payload.get("meterStop"),
-        }
-    if action == "MeterValues":
-        return {
-            "connectorId": payload.get("connectorId"),
-            "transactionId": payload.get("transactionId"),
-        }
-    if action == "SetChargingProfile":
-        profile = payload.get("chargingProfile")
-        schedule = profile.get("chargingSchedule") if isinstance(profile, dict) else {}
-        periods = schedule.get("chargingSchedulePeriod") if isinstance(schedule, dict) else []
-        first = periods[0] if isinstance(periods, list) and periods else {}
-        return {
-            "profileId": get_charging_profile_id(payload),
-            "stackLevel": profile.get("stackLevel") if isinstance(profile, dict) else None,
-            "purpose": profile.get("chargingProfilePurpose") if isinstance(profile, dict) else None,
-            "limit": first.get("limit") if isinstance(first, dict) else None,
-        }
-    if action == "ClearChargingProfile":
-        return {"profileId": get_charging_profile_id(payload)}
+def _summarize_boot(payload: dict[str, object]) -> dict[str, object]:
+    return {
+        "vendor": payload.get("chargePointVendor"),
+        "model": payload.get("chargePointModel"),
+    }
+
+
+def _summarize_empty(payload: dict[str, object]) -> dict[str, object]:
     return {}
 
 
-def _validate_payload(action: str, payload: dict[str, object]) -> None:
-    if action == "BootNotification":
-        if not isinstance(payload.get("chargePointVendor"), str):
-            raise ValidationError("PropertyConstraintViolation", "chargePointVendor must be a string")
-        if not isinstance(payload.get("chargePointModel"), str):
-            raise ValidationError("PropertyConstraintViolation", "chargePointModel must be a string")
-        return
+def _summarize_status_notification(payload: dict[str, object]) -> dict[str, object]:
+    return {
+        "connectorId": payload.get("connectorId"),
+        "status": payload.get("status"),
+        "errorCode": payload.get("errorCode"),
+    }
 
-    if action == "Heartbeat":
-        return
 
-    if action == "StatusNotification":
-        connector_id = payload.get("connectorId")
-        status = payload.get("status")
-        error_code = payload.get("errorCode")
-        if connector_id not in (0, 1):
-            raise ValidationError("PropertyConstraintViolation", "connectorId must be 0 or 1")
-        if status != "Available":
-            raise ValidationError("PropertyConstraintViolation", "status must be Available")
-        if error_code != "NoError":
-            raise ValidationError("PropertyConstraintViolation", "errorCode must be NoError")
-        return
+def _summarize_start_transaction(payload: dict[str, object]) -> dict[str, object]:
+    return {
+        "connectorId": payload.get("connectorId"),
+        "idTag": payload.get("idTag"),
+        "meterStart": payload.get("meterStart"),
+    }
 
-    if action == "StartTransaction":
-        connector_id = payload.get("connectorId")
-        if connector_id not in (0, 1):
-            raise ValidationError("PropertyConstraintViolation", "connectorId must be 0 or 1")
-        if not isinstance(payload.get("idTag"), str) or not payload.get("idTag"):
-            raise ValidationError("PropertyConstraintViolation", "idTag must be a non-empty string")
-        coerce_int(payload.get("meterStart"), "meterStart")
-        parse_iso_z(payload.get("timestamp"), "timestamp")
-        return
 
-    if action == "StopTransaction":
-        coerce_int(payload.get("transactionId"), "transactionId")
-        coerce_int(payload.get("meterStop"), "meterStop")
-        parse_iso_z(payload.get("timestamp"), "timestamp")
-        return
+def _summarize_stop_transaction(payload: dict[str, object]) -> dict[str, object]:
+    return {
+        "transactionId": payload.get("transactionId"),
+        "meterStop": payload.get("meterStop"),
+    }
 
-    if action == "MeterValues":
-        connector_id = payload.get("connectorId")
-        meter_value = payload.get("meterValue")
-        if connector_id not in (0, 1):
-            raise ValidationError("PropertyConstraintViolation", "connectorId must be 0 or 1")
-        if not isinstance(meter_value, list) or not meter_value:
-            raise ValidationError("PropertyConstraintViolation", "meterValue must be a non-empty list")
-        first = meter_value[0]
-        if not isinstance(first, dict):
-            raise ValidationError("PropertyConstraintViolation", "meterValue entry must be an object")
-        parse_iso_z(first.get("timestamp"), "timestamp")
-        sampled = first.get("sampledValue")
-        if not isinstance(sampled, list) or not sampled:
-            raise ValidationError("PropertyConstraintViolation", "sampledValue must be a non-empty list")
-        first_sample = sampled[0]
-        if not isinstance(first_sample, dict):
-            raise ValidationError("PropertyConstraintViolation", "sampledValue entry must be an object")
-        if "value" not in first_sample:
-            raise ValidationError("PropertyConstraintViolation", "sampledValue.value is required")
-        return
 
-    if action == "SetChargingProfile":
-        charging_profile = payload.get("chargingProfile")
-        if not isinstance(charging_profile, dict):
-            raise ValidationError("PropertyConstraintViolation", "chargingProfile must be an object")
-        coerce_int(charging_profile.get("chargingProfileId"), "chargingProfileId")
-        coerce_int(charging_profile.get("stackLevel"), "stackLevel")
-        if not isinstance(charging_profile.get("chargingProfilePurpose"), str):
-            raise ValidationError("PropertyConstraintViolation", "chargingProfilePurpose must be a string")
-        if not isinstance(charging_profile.get("chargingProfileKind"), str):
-            raise ValidationError("PropertyConstraintViolation", "chargingProfileKind must be a string")
-        schedule = charging_profile.get("chargingSchedule")
-        if not isinstance(schedule, dict):
-            raise ValidationError("PropertyConstraintViolation", "chargingSchedule must be an object")
-        if not isinstance(schedule.get("chargingRateUnit"), str):
-            raise ValidationError("PropertyConstraintViolation", "chargingRateUnit must be a string")
-        periods = schedule.get("chargingSchedulePeriod")
-        if not isinstance(periods, list) or not periods:
-            raise ValidationError("PropertyConstraintViolation", "chargingSchedulePeriod must be a non-empty list")
-        first = periods[0]
-        if not isinstance(first, dict):
-            raise ValidationError("PropertyConstraintViolation", "chargingSchedulePeriod entry must be an object")
-        if "limit" not in first:
-            raise ValidationError("PropertyConstraintViolation", "chargingSchedulePeriod.limit is required")
-        if not isinstance(first.get("limit"), (int, float)):
-            raise ValidationError("PropertyConstraintViolation", "chargingSchedulePeriod.limit must be a number")
-        return
+def _summarize_meter_values(payload: dict[str, object]) -> dict[str, object]:
+    return {
+        "connectorId": payload.get("connectorId"),
+        "transactionId": payload.get("transactionId"),
+    }
 
-    if action == "ClearChargingProfile":
-        profile_id = payload.get("chargingProfileId")
-        if profile_id is not None:
-            coerce_int(profile_id, "chargingProfileId")
-        return
 
+def _summarize_set_charging_profile(payload: dict[str, object]) -> dict[str, object]:
+    profile = payload.get("chargingProfile")
+    schedule = profile.get("chargingSchedule") if isinstance(profile, dict) else {}
+    periods = schedule.get("chargingSchedulePeriod") if isinstance(schedule, dict) else []
+    first = periods[0] if isinstance(periods, list) and periods else {}
+    return {
+        "profileId": get_charging_profile_id(payload),
+        "stackLevel": profile.get("stackLevel") if isinstance(profile, dict) else None,
+        "purpose": profile.get("chargingProfilePurpose") if isinstance(profile, dict) else None,
+        "limit": first.get("limit") if isinstance(first, dict) else None,
+    }
+
+
+def _summarize_clear_charging_profile(payload: dict[str, object]) -> dict[str, object]:
+    return {"profileId": get_charging_profile_id(payload)}
+
+
+def _is_iso_z(text: str) -> bool:
+    try:
+        parse_iso_z(text, "timestamp")
+    except ValueError:
+        return False
+    return True
+
+
+def _is_int_string(text: str) -> bool:
+    try:
+        int(text)
+    except ValueError:
+        return False
+    return True
+
+
+# Integer fields keep accepting numeric strings, as coerce_int() in the handlers does.
+_INTEGER = {"type": ["integer", "string"], "format": "int-string"}
+_CONNECTOR_ID = {"enum": [0, 1]}
+_TIMESTAMP = {"type": "string", "format": "iso-z"}
+_STRING = {"type": "string"}
+
+_SCHEMAS: dict[str, dict[str, object]] = {
+    "BootNotification": {
+        "type": "object",
+        "required": ["chargePointVendor", "chargePointModel"],
+        "properties": {"chargePointVendor": _STRING, "chargePointModel": _STRING},
+    },
+    "Heartbeat": {"type": "object"},
+    "StatusNotification": {
+        "type": "object",
+        "required": ["connectorId", "status", "errorCode"],
+        "properties": {
+            "connectorId": _CONNECTOR_ID,
+            "status": {"const": "Available"},
+            "errorCode": {"const": "NoError"},
+        },
+    },
+    "StartTransaction": {
+        "type": "object",
+        "required": ["connectorId", "idTag", "meterStart", "timestamp"],
+        "properties": {
+            "connectorId": _CONNECTOR_ID,
+            "idTag": {"type": "string", "minLength": 1},
+            "meterStart": _INTEGER,
+            "timestamp": _TIMESTAMP,
+        },
+    },
+    "StopTransaction": {
+        "type": "object",
+        "required": ["transactionId", "meterStop", "timestamp"],
+        "properties": {"transactionId": _INTEGER, "meterStop": _INTEGER, "timestamp": _TIMESTAMP},
+    },
+    "MeterValues": {
+        "type": "object",
+        "required": ["connectorId", "meterValue"],
+        "properties": {
+            "connectorId": _CONNECTOR_ID,
+            # Only the first reading is read by the handler, so only it is constrained (tuple form).
+            "meterValue": {
+                "type": "array",
+                "minItems": 1,
+                "items": [
+                    {
+                        "type": "object",
+                        "required": ["timestamp", "sampledValue"],
+                        "properties": {
+                            "timestamp": _TIMESTAMP,
+                            "sampledValue": {
+                                "type": "array",
+                                "minItems": 1,
+                                "items": [
+                                    {
+                                        "type": "object",
+                                        "required": ["value"],
+                                        "properties": {"value": _INTEGER},
+                                    }
+                                ],
+                            },
+                        },
+                    }
+                ],
+            },
+        },
+    },
+    "SetChargingProfile": {
+        "type": "object",
+        "required": ["chargingProfile"],
+        "properties": {
+            "chargingProfile": {
+                "type": "object",
+                "required": [
+                    "chargingProfileId",
+                    "stackLevel",
+                    "chargingProfilePurpose",
+                    "chargingProfileKind",
+                    "chargingSchedule",
+                ],
+                "properties": {
+                    "chargingProfileId": _INTEGER,
+                    "stackLevel": _INTEGER,
+                    "chargingProfilePurpose": _STRING,
+                    "chargingProfileKind": _STRING,
+                    "chargingSchedule": {
+                        "type": "object",
+                        "required": ["chargingRateUnit", "chargingSchedulePeriod"],
+                        "properties": {
+                            "chargingRateUnit": _STRING,
+                            "chargingSchedulePeriod": {
+                                "type": "array",
+                                "minItems": 1,
+                                "items": [
+                                    {
+                                        "type": "object",
+                                        "required": ["limit"],
+                                        "properties": {"limit": {"type": "number"}},
+                                    }
+                                ],
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+    "ClearChargingProfile": {
+        "type": "object",
+        "properties": {"chargingProfileId": {"type": ["integer", "string", "null"], "format": "int-string"}},
+    },
+}
+
+
+def _reject(payload: dict[str, object]) -> None:
     raise ValidationError("PropertyConstraintViolation", "unsupported action")
 
 
-def _send_call_error(
-    websocket: websockets.WebSocketServerProtocol,
+_SUMMARIZERS: dict[str, Callable[[dict[str, object]], dict[str, object]]] = {
+    "BootNotification": _summarize_boot,
+    "Heartbeat": _summarize_empty,
+    "StatusNotification": _summarize_status_notification,
+    "StartTransaction": _summarize_start_transaction,
+    "StopTransaction": _summarize_stop_transaction,
+    "MeterValues": _summarize_meter_values,
+    "SetChargingProfile": _summarize_set_charging_profile,
+    "ClearChargingProfile": _summarize_clear_charging_profile,
+}
+
+_VALIDATORS: dict[str, Callable[[dict[str, object]], object]] = {
+    action: fastjsonschema.compile(schema, formats={"iso-z": _is_iso_z, "int-string": _is_int_string})
+    for action, schema in _SCHEMAS.items()
+}
+
+_FORMAT_DESCRIPTIONS = {"iso-z": "must be ISO-8601", "int-string": "must be an integer"}
+_TYPE_DESCRIPTIONS = {
+    "string": "must be a string",
+    "number": "must be a number",
+    "object": "must be an object",
+    "array": "must be a list",
+}
+
+
+def _describe_schema_error(exc: fastjsonschema.JsonSchemaValueException) -> str:
+    field = exc.name.removeprefix("data").removeprefix(".")
+    rule, definition = exc.rule, exc.rule_definition
+    if rule == "required":
+        missing = next(name for name in definition if name not in exc.value)
+        return f"{field}.{missing} is required" if field else f"{missing} is required"
+    if rule == "format":
+        description = _FORMAT_DESCRIPTIONS[definition]
+    elif rule == "type":
+        kinds = definition if isinstance(definition, list) else [definition]
+        description = "must be an integer" if "integer" in kinds else _TYPE_DESCRIPTIONS[kinds[0]]
+    elif rule == "enum":
+        description = "must be " + " or ".join(str(value) for value in definition)
+    elif rule == "const":
+        description = f"must be {definition}"
+    elif rule == "minItems":
+        description = "must be a non-empty list"
+    elif rule == "minLength":
+        description = "must be a non-empty string"
+    else:
+        return exc.message
+    return f"{field} {description}"
+
+
+def _handle_boot(
+    session: ChargePointSession,
+    payload: dict[str, object],
+    charge_point_id: str,
+    uid: str,
+) -> bytes:
+    session.boot_accepted = True
+    session.boot_info = payload
+    _state_summary_cache[charge_point_id]["boot_accepted"] = True
+    return _BOOT_RESULT_TEMPLATE % (dumps_bytes(uid), dumps_bytes(utc_now_iso_z()))
+
+
+def _handle_heartbeat(
+    session: ChargePointSession,
+    payload: dict[str, object],
+    charge_point_id: str,
+    uid: str,
+) -> bytes:
+    session.last_heartbeat_at = session.last_seen_at
+    return encode_heartbeat_call_result(uid)
+
+
+def _handle_status_notification(
+    session: ChargePointSession,
+    payload: dict[str, object],
+    charge_point_id: str,
+    uid: str,
+) -> bytes:
+    session.status = str(payload.get("status"))
+    session.connector_id = int(payload.get("connectorId"))
+    return encode_empty_call_result(uid)
+
+
+def _handle_start_transaction(
+    session: ChargePointSession,
+    payload: dict[str, object],
+    charge_point_id: str,
+    uid: str,
+) -> bytes:
+    global _next_transaction_id
+    transaction_id = _next_transaction_id
+    _next_transaction_id += _transaction_id_step
+    session.active_transaction_id = transaction_id
+    _state_summary_cache[charge_point_id]["active_transaction_id"] = transaction_id
+    session.transactions[transaction_id] = {
+        "started_at": session.last_seen_at.isoformat(),
+        "meterStart": int(payload.get("meterStart")),
+        "idTag": payload.get("idTag"),
+        "connectorId": payload.get("connectorId"),
+    }
+    logger.info(
+        "StartTransaction: chargePointId=%s transactionId=%s",
+        charge_point_id,
+        transaction_id,
+    )
+    return _START_TRANSACTION_RESULT_TEMPLATE % (dumps_bytes(uid), transaction_id)
+
+
+def _handle_stop_transaction(
+    session: ChargePointSession,
+    payload: dict[str, object],
+    charge_point_id: str,
+    uid: str,
+) -> bytes:
+    transaction_id = coerce_int(payload.get("transactionId"), "transactionId")
+    meter_stop = coerce_int(payload.get("meterStop"), "meterStop")
+    session.active_transaction_id = None
+    session.last_meter_wh = meter_stop
+    entry = _state_summary_cache[charge_point_id]
+    entry["active_transaction_id"] = None
+    entry["last_meter_wh"] = meter_stop
+    tx = session.transactions.get(transaction_id, {})
+    tx.update({"stopped_at": session.last_seen_at.isoformat(), "meterStop": meter_stop})
+    session.transactions[transaction_id] = tx
+    logger.info(
+        "StopTransaction: transactionId=%s meterStop=%s",
+        transaction_id,
+        meter_stop,
+    )
+    return _ID_TAG_ACCEPTED_RESULT_TEMPLATE % dumps_bytes(uid)
+
+
+def _handle_meter_values(
+    session: ChargePointSession,
+    payload: dict[str, object],
+    charge_point_id: str,
+    uid: str,
+) -> bytes:
+    meter_value = payload.get("meterValue")
+    first = meter_value[0] if isinstance(meter_value, list) and meter_value else {}
+    sampled = first.get("sampledValue") if isinstance(first, dict) else []
+    first_sample = sampled[0] if isinstance(sampled, list) and sampled else {}
+    value = coerce_int(first_sample.get("value"), "sampledValue.value")
+    session.last_meter_wh = value
+    _state_summary_cache[charge_point_id]["last_meter_wh"] = value
+    logger.info(
+        "MeterValues: chargePointId=%s connectorId=%s transactionId=%s timestamp=%s value=%s",
+        charge_point_id,
+        payload.get("connectorId"),
+        payload.get("transactionId"),
+        first.get("timestamp"),
+        value,
+    )
+    return encode_empty_call_result(uid)
+
+
+def _handle_set_charging_profile(
+    session: ChargePointSession,
+    payload: dict[str, object],
+    charge_point_id: str,
+    uid: str,
+) -> bytes:
+    charging_profile = payload.get("chargingProfile", {})
+    profile_id = coerce_int(charging_profile.get("chargingProfileId"), "chargingProfileId")
+    stack_level = coerce_int(charging_profile.get("stackLevel"), "stackLevel")
+    purpose = charging_profile.get("chargingProfilePurpose")
+    schedule = charging_profile.get("chargingSchedule", {})
+    periods = schedule.get("chargingSchedulePeriod", [])
+    first = periods[0] if isinstance(periods, list) and periods else {}
+    limit = first.get("limit") if isinstance(first, dict) else None
+    session.charging_profiles[profile_id] = {
+        "profile": charging_profile,
+        "received_at": session.last_seen_at.isoformat(),
+        "limit_w": limit,
+        "purpose": purpose,
+        "stackLevel": stack_level,
+    }
+    _state_summary_cache[charge_point_id]["charging_profiles"] = _profile_summaries(session)
+    logger.info(
+        "SetChargingProfile: chargePointId=%s profileId=%s stackLevel=%s limit=%s purpose=%s",
+        charge_point_id,
+        profile_id,
+        stack_level,
+        limit,
+        purpose,
+    )
+    return _ACCEPTED_RESULT_TEMPLATE % dumps_bytes(uid)
+
+
+def _handle_clear_charging_profile(
+    session: ChargePointSession,
+    payload: dict[str, object],
+    charge_point_id: str,
+    uid: str,
+) -> bytes:
+    profile_id = payload.get("chargingProfileId")
+    cleared = []
+    if profile_id is None:
+        cleared = list(session.charging_profiles.keys())
+        session.charging_profiles.clear()
+    else:
+        profile_id_int = coerce_int(profile_id, "chargingProfileId")
+        if profile_id_int in session.charging_profiles:
+            session.charging_profiles.pop(profile_id_int, None)
+            cleared = [profile_id_int]
+    _state_summary_cache[charge_point_id]["charging_profiles"] = _profile_summaries(session)
+    logger.info(
+        "ClearChargingProfile: chargePointId=%s cleared=%s",
+        charge_point_id,
+        cleared,
+    )
+    return _ACCEPTED_RESULT_TEMPLATE % dumps_bytes(uid)
+
+
+_HANDLERS: dict[str, Callable[[ChargePointSession, dict[str, object], str, str], bytes]] = {
+    "BootNotification": _handle_boot,
+    "Heartbeat": _handle_heartbeat,
+    "StatusNotification": _handle_status_notification,
+    "StartTransaction": _handle_start_transaction,
+    "StopTransaction": _handle_stop_transaction,
+    "MeterValues": _handle_meter_values,
+    "SetChargingProfile": _handle_set_charging_profile,
+    "ClearChargingProfile": _handle_clear_charging_profile,
+}
+
+
+def _message_span(charge_point_id: str, message_length: int, parent_context: object) -> AbstractContextManager[object]:
+    if not _TRACING_ENABLED:
+        return nullcontext()
+    return tracer.start_as_current_span(
+        "ws.message",
+        context=parent_context,
+        attributes={"ocpp.charge_point_id": charge_point_id, "ws.message_length": message_length},
+    )
+
+
+async def _writer(websocket: websockets.WebSocketServerProtocol, outbox: asyncio.Queue[str | bytes]) -> None:
+    sock = websocket.transport.get_extra_info("socket")
+    while True:
+        try:
+            await send_queued_frames(websocket, outbox, sock)
+        except ConnectionClosed:
+            # The receive loop sees the close and tears the connection down.
+            pass
+
+
+async def _send_call_error(
+    outbox: asyncio.Queue[str | bytes],
     charge_point_id: str,
     uid: str,
     code: str,
     description: str,
     action: str,
-) -> asyncio.Task:
-    frame = make_call_error(uid, code, description)
-    text = json.dumps(frame)
+) -> None:
+    template = _CALL_ERROR_TEMPLATES.get(code)
+    if template is not None:
+        text = template % (dumps_bytes(uid), dumps_bytes(description))
+    else:
+        text = dumps_bytes(make_call_error(uid, code, description))
     _compact_log(charge_point_id, "TX", action, uid, {"error": code, "message": description})
     _raw_log("TX", charge_point_id, text)
-    return asyncio.create_task(websocket.send(text))
+    await outbox.put(text)
 
 
 async def _send_call_result(
-    websocket: websockets.WebSocketServerProtocol,
+    outbox: asyncio.Queue[str | bytes],
     charge_point_id: str,
     uid: str,
     action: str,
-    payload: dict[str, object],
+    text: bytes,
 ) -> None:
-    frame = make_call_result(uid, payload)
-    text = json.dumps(frame)
     _compact_log(charge_point_id, "TX", action, uid, {"result": True})
     _raw_log("TX", charge_point_id, text)
-    await websocket.send(text)
+    await outbox.put(text)
 
 
 def _dump_state_summary() -> dict[str, object]:
-    items = []
-    for cp_id, session in _sessions.items():
-        profiles = []
-        for profile_id, profile_data in session.charging_profiles.items():
-            profiles.append(
-                {
-                    "id": profile_id,
-                    "limit_w": profile_data.get("limit_w"),
-                }
-            )
-        items.append(
-            {
-                "chargePointId": cp_id,
-                "boot_accepted": session.boot_accepted,
-                "active_transaction_id": session.active_transaction_id,
-                "last_seen_at": session.last_seen_at.isoformat() if session.last_seen_at else None,
-                "last_meter_wh": session.last_meter_wh,
-                "charging_profiles": profiles,
-            }
-        )
-    return {"sessions": items}
+    # last_seen_at changes on every frame, so it is filled in at dump time.
+    for cp_id, entry in _state_summary_cache.items():
+        entry["last_seen_at"] = _sessions[cp_id].last_seen_at
+    return {"sessions": list(_state_summary_cache.values())}
 
 
-async def _send_error_and_close(websocket: websockets.WebSocketServerProtocol, text: str) -> None:
-    await websocket.send(text)
+async def _send_error_and_close(
+    websocket: websockets.WebSocketServerProtocol,
+    outbox: asyncio.Queue[str | bytes],
+    text: str,
+) -> None:
+    # Flush queued replies first so the error is the last frame before the close.
+    await outbox.put(text)
+    await outbox.join()
     await websocket.close(code=1002, reason=text)
 
 
@@ -362,9 +776,12 @@ async def handle_client(websocket: websockets.WebSocketServerProtocol) -> None:
 
     session = _get_session(charge_point_id)
     session.connected = True
-    session.connected_at = _now()
-    session.last_seen_at = _now()
+    session.connected_at = session.last_seen_at = _now()
     logger.info("Client connected: %s", charge_point_id)
+    # The event loop already sets TCP_NODELAY; this adds TCP_QUICKACK on Linux.
+    tune_tcp_socket(websocket.transport.get_extra_info("socket"))
+    outbox: asyncio.Queue[str | bytes] = asyncio.Queue(maxsize=OUTBOX_MAX_FRAMES)
+    writer = asyncio.create_task(_writer(websocket, outbox))
 
     try:
         request_headers = getattr(websocket, "request_headers", None)
@@ -373,166 +790,93 @@ async def handle_client(websocket: websockets.WebSocketServerProtocol) -> None:
         if request_headers is None:
             request_headers = {}
 
-        parent_context = propagate.extract(request_headers)
-        async for message in websocket:
-            session.last_seen_at = _now()
-            _raw_log("RX", charge_point_id, message)
-            if message == "DUMP_STATE":
+        if _TRACING_ENABLED and "traceparent" in request_headers:
+            parent_context = propagate.extract(request_headers)
+        else:
+            parent_context = None
+
+        now = _now
+        raw_log = _raw_log
+        compact_log = _compact_log
+        parse = parse_call
+        get_summarizer = _SUMMARIZERS.get
+        get_validator = _VALIDATORS.get
+        get_handler = _HANDLERS.get
+        send_call_result = _send_call_result
+        send_call_error = _send_call_error
+        message_span = _message_span
+        recv = websocket.recv
+        while True:
+            message = await recv(decode=False)
+            session.last_seen_at = now()
+            raw_log("RX", charge_point_id, message)
+            if message == b"DUMP_STATE":
                 summary = _dump_state_summary()
-                text = json.dumps(summary)
-                _compact_log(charge_point_id, "TX", "DUMP_STATE", "-", {"sessions": len(summary["sessions"])})
-                _raw_log("TX", charge_point_id, text)
-                await websocket.send(text)
+                text = dumps_bytes(summary)
+                compact_log(charge_point_id, "TX", "DUMP_STATE", "-", {"sessions": len(summary["sessions"])})
+                raw_log("TX", charge_point_id, text)
+                await outbox.put(text)
                 continue
 
-            with tracer.start_as_current_span("ws.message", context=parent_context) as span:
-                span.set_attribute("ocpp.charge_point_id", charge_point_id)
-                span.set_attribute("ws.message_length", len(message))
-
-                try:
-                    data = parse_message(message)
-                except json.JSONDecodeError as exc:
+            # Every OCPP-J frame is a JSON array (JSON allows leading whitespace), so screen out the rest.
+            if message.lstrip(b" \t\r\n")[:1] != b"[":
+                with message_span(charge_point_id, len(message), parent_context):
+                    logger.error("Non-CALL frame from %s", charge_point_id)
+                    await _send_error_and_close(websocket, outbox, "ERROR: invalid CALL frame")
+                return
+
+            try:
+                uid, action, payload = parse(message)
+            except json.JSONDecodeError as exc:
+                with message_span(charge_point_id, len(message), parent_context):
                     logger.error("Invalid JSON from %s: %s", charge_point_id, exc.msg)
-                    await _send_error_and_close(websocket, "ERROR: invalid JSON")
-                    return
+                    await _send_error_and_close(websocket, outbox, "ERROR: invalid JSON")
+                return
+            except CallFormatError as exc:
+                with message_span(charge_point_id, len(message), parent_context):
+                    compact_log(charge_point_id, "RX", "INVALID", exc.uid or "UNKNOWN", {"error": str(exc)})
+                    if exc.uid is None:
+                        await _send_error_and_close(websocket, outbox, "ERROR: invalid CALL frame")
+                        return
+                    await send_call_error(
+                        outbox,
+                        charge_point_id,
+                        exc.uid,
+                        "FormationViolation",
+                        str(exc),
+                        "INVALID",
+                    )
+                continue
 
-                try:
-                    uid, action, payload = validate_call(data)
-                except ValueError as exc:
-                    uid = data[1] if isinstance(data, list) and len(data) > 1 and isinstance(data[1], str) else "UNKNOWN"
-                    _compact_log(charge_point_id, "RX", "INVALID", uid, {"error": str(exc)})
-                    if uid != "UNKNOWN":
-                        await _send_call_error(
-                            websocket,
-                            charge_point_id,
-                            uid,
-                            "FormationViolation",
-                            str(exc),
-                            "INVALID",
-                        )
-                        continue
-                    await _send_error_and_close(websocket, "ERROR: invalid CALL frame")
-                    return
-
-                summary = _summary_for(action, payload)
-                _compact_log(charge_point_id, "RX", action, uid, summary)
+            # Heartbeats dominate traffic and carry no signal worth a span of their own.
+            if action == "Heartbeat":
+                span_ctx = nullcontext()
+            else:
+                span_ctx = message_span(charge_point_id, len(message), parent_context)
+            with span_ctx:
+                summary = get_summarizer(action, _summarize_empty)(payload)
+                compact_log(charge_point_id, "RX", action, uid, summary)
 
                 try:
-                    _validate_payload(action, payload)
+                    get_validator(action, _reject)(payload)
+                except fastjsonschema.JsonSchemaValueException as exc:
+                    await send_call_error(
+                        outbox,
+                        charge_point_id,
+                        uid,
+                        "PropertyConstraintViolation",
+                        _describe_schema_error(exc),
+                        action,
+                    )
+                    continue
                 except ValidationError as exc:
-                    await _send_call_error(websocket, charge_point_id, uid, exc.code, str(exc), action)
+                    await send_call_error(outbox, charge_point_id, uid, exc.code, str(exc), action)
                     continue
 
-                if action == "BootNotification":
-                    session.boot_accepted = True
-                    session.boot_info = payload
-                    result_payload = {
-                        "status": "Accepted",
-                        "currentTime": utc_now_iso_z(),
-                        "interval": HEARTBEAT_INTERVAL_SECONDS,
-                    }
-                elif action == "Heartbeat":
-                    session.last_heartbeat_at = _now()
-                    result_payload = {"currentTime": utc_now_iso_z()}
-                elif action == "StatusNotification":
-                    session.status = str(payload.get("status"))
-                    session.connector_id = int(payload.get("connectorId"))
-                    result_payload = {}
-                elif action == "StartTransaction":
-                    global _next_transaction_id
-                    transaction_id = _next_transaction_id
-                    _next_transaction_id += 1
-                    session.active_transaction_id = transaction_id
-                    session.transactions[transaction_id] = {
-                        "started_at": _now().isoformat(),
-                        "meterStart": int(payload.get("meterStart")),
-                        "idTag": payload.get("idTag"),
-                        "connectorId": payload.get("connectorId"),
-                    }
-                    result_payload = {
-                        "transactionId": transaction_id,
-                        "idTagInfo": {"status": "Accepted"},
-                    }
-                    logger.info(
-                        "StartTransaction: chargePointId=%s transactionId=%s",
-                        charge_point_id,
-                        transaction_id,
-                    )
-                elif action == "StopTransaction":
-                    transaction_id = coerce_int(payload.get("transactionId"), "transactionId")
-                    meter_stop = coerce_int(payload.get("meterStop"), "meterStop")
-                    session.active_transaction_id = None
-                    session.last_meter_wh = meter_stop
-                    tx = session.transactions.get(transaction_id, {})
-                    tx.update({"stopped_at": _now().isoformat(), "meterStop": meter_stop})
-                    session.transactions[transaction_id] = tx
-                    result_payload = {"idTagInfo": {"status": "Accepted"}}
-                    logger.info(
-                        "StopTransaction: transactionId=%s meterStop=%s",
-                        transaction_id,
-                        meter_stop,
-                    )
-                elif action == "MeterValues":
-                    meter_value = payload.get("meterValue")
-                    first = meter_value[0] if isinstance(meter_value, list) and meter_value else {}
-                    sampled = first.get("sampledValue") if isinstance(first, dict) else []
-                    first_sample = sampled[0] if isinstance(sampled, list) and sampled else {}
-                    value = coerce_int(first_sample.get("value"), "sampledValue.value")
-                    session.last_meter_wh = value
-                    result_payload = {}
-                    logger.info(
-                        "MeterValues: chargePointId=%s connectorId=%s transactionId=%s timestamp=%s value=%s",
-                        charge_point_id,
-                        payload.get("connectorId"),
-                        payload.get("transactionId"),
-                        first.get("timestamp"),
-                        value,
-                    )
-                elif action == "SetChargingProfile":
-                    charging_profile = payload.get("chargingProfile", {})
-                    profile_id = coerce_int(charging_profile.get("chargingProfileId"), "chargingProfileId")
-                    stack_level = coerce_int(charging_profile.get("stackLevel"), "stackLevel")
-                    purpose = charging_profile.get("chargingProfilePurpose")
-                    schedule = charging_profile.get("chargingSchedule", {})
-                    periods = schedule.get("chargingSchedulePeriod", [])
-                    first = periods[0] if isinstance(periods, list) and periods else {}
-                    limit = first.get("limit") if isinstance(first, dict) else None
-                    session.charging_profiles[profile_id] = {
-                        "profile": charging_profile,
-                        "received_at": _now().isoformat(),
-                        "limit_w": limit,
-                        "purpose": purpose,
-                        "stackLevel": stack_level,
-                    }
-                    result_payload = {"status": "Accepted"}
-                    logger.info(
-                        "SetChargingProfile: chargePointId=%s profileId=%s stackLevel=%s limit=%s purpose=%s",
-                        charge_point_id,
-                        profile_id,
-                        stack_level,
-                        limit,
-                        purpose,
-                    )
-                elif action == "ClearChargingProfile":
-                    profile_id = payload.get("chargingProfileId")
-                    cleared = []
-                    if profile_id is None:
-                        cleared = list(session.charging_profiles.keys())
-                        session.charging_profiles.clear()
-                    else:
-                        profile_id_int = coerce_int(profile_id, "chargingProfileId")
-                        if profile_id_int in session.charging_profiles:
-                            session.charging_profiles.pop(profile_id_int, None)
-                            cleared = [profile_id_int]
-                    result_payload = {"status": "Accepted"}
-                    logger.info(
-                        "ClearChargingProfile: chargePointId=%s cleared=%s",
-                        charge_point_id,
-                        cleared,
-                    )
-                else:
-                    await _send_call_error(
-                        websocket,
+                handler = get_handler(action)
+                if handler is None:
+                    await send_call_error(
+                        outbox,
                         charge_point_id,
                         uid,
                         "NotSupported",
@@ -541,25 +885,113 @@ async def handle_client(websocket: websockets.WebSocketServerProtocol) -> None:
                     )
                     continue
 
-                await _send_call_result(websocket, charge_point_id, uid, action, result_payload)
+                result_frame = handler(session, payload, charge_point_id, uid)
+                await send_call_result(outbox, charge_point_id, uid, action, result_frame)
     except ConnectionClosed:
         pass
     finally:
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
         session.connected = False
         session.disconnected_at = _now()
         logger.info("Client disconnected: %s", charge_point_id)
 
 
-async def main() -> None:
+async def main(worker_index: int | None = None, worker_count: int = 1) -> None:
+    global _next_transaction_id, _transaction_id_step
+    if worker_index is not None:
+        _next_transaction_id, _transaction_id_step = worker_index + 1, worker_count
+    setup_console_logging()
     setup_tracing()
-    setup_raw_logging()
+    # RotatingFileHandler cannot share a file across processes, so each worker rotates its own.
+    if worker_index is None:
+        setup_raw_logging()
+    else:
+        setup_raw_logging(f"logs/ocpp_raw.{worker_index}.log")
     logger.addHandler(SpanEventHandler())
     host = os.getenv("APP_HOST", "localhost")
     port = int(os.getenv("APP_PORT", "9000"))
-    logger.info("Starting server on ws://%s:%s/{chargePointId}", host, port)
-    async with websockets.serve(handle_client, host, port):
-        await asyncio.Future()
+    serve_options = {
+        "compression": None,
+        "max_size": MAX_FRAME_SIZE,
+        "max_queue": 16,
+        "write_limit": 8192,
+        "backlog": 2048,
+    }
+    uds_path = os.getenv("UDS_PATH")
+    if uds_path:
+        logger.info("Starting server on unix:%s /{chargePointId}", uds_path)
+        server_ctx = websockets.unix_serve(handle_client, uds_path, **serve_options)
+    else:
+        logger.info("Starting server on ws://%s:%s/{chargePointId}", host, port)
+        server_ctx = websockets.serve(handle_client, host, port, reuse_port=worker_index is not None, **serve_options)
+    # Signals end the wait instead of raising KeyboardInterrupt, so open connections close cleanly.
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:  # Windows: Ctrl+C still raises KeyboardInterrupt
+            pass
+    async with server_ctx:
+        await stop.wait()
+        logger.info("Shutting down")
+
+
+def _raise_system_exit(signum: int, frame: object) -> None:
+    raise SystemExit(0)
+
+
+def pin_to_cpu(offset: int = 0) -> None:
+    # Must run before main() so the log listener threads inherit the affinity.
+    pin_cpu = os.getenv("PIN_CPU")
+    if pin_cpu is None or not hasattr(os, "sched_setaffinity"):
+        return
+    # A cgroup cpuset or container can exclude CPUs, so workers walk the allowed set from PIN_CPU.
+    allowed = sorted(os.sched_getaffinity(0))
+    cpu = int(pin_cpu)
+    if cpu not in allowed:
+        raise ValueError(f"PIN_CPU={pin_cpu} is not one of the CPUs this process may use: {allowed}")
+    os.sched_setaffinity(0, {allowed[(allowed.index(cpu) + offset) % len(allowed)]})
+
+
+def _run_exit_callbacks() -> None:
+    # multiprocessing children leave through os._exit, which skips atexit.
+    while _exit_callbacks:
+        callback = _exit_callbacks.pop()
+        atexit.unregister(callback)
+        callback()
+
+
+def _run_worker(index: int, count: int) -> None:
+    pin_to_cpu(index)
+    try:
+        run_event_loop(main(index, count))
+    finally:
+        _run_exit_callbacks()
+
+
+def run_workers(count: int) -> None:
+    workers = [
+        multiprocessing.Process(target=_run_worker, args=(i, count), name=f"ocpp-worker-{i}") for i in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    signal.signal(signal.SIGTERM, _raise_system_exit)
+    try:
+        for worker in workers:
+            worker.join()
+    except (KeyboardInterrupt, SystemExit):
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    worker_count = int(os.getenv("WORKERS", "1"))
+    if worker_count > 1 and not os.getenv("UDS_PATH"):
+        run_workers(worker_count)
+    else:
+        pin_to_cpu()
+        run_event_loop(main())
@@ -0,0 +1,25 @@
+import asyncio
+
+import websockets
+
+from ocpp16_min import client
+from ocpp16_min.common import encode_heartbeat_call
+
+
+def test_request_fails_once_the_peer_goes_away() -> None:
+    async def drop_connection(websocket) -> None:
+        await websocket.recv()
+        websocket.transport.abort()
+
+    async def run() -> list[tuple[object, bool]]:
+        async with websockets.serve(drop_connection, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}/CP_T") as websocket:
+                async with client._CallDispatcher(websocket) as dispatcher:
+                    results = []
+                    for _ in range(2):
+                        uid, frame = encode_heartbeat_call()
+                        results.append(await asyncio.wait_for(dispatcher.request("Heartbeat", uid, frame), 5))
+                    return results
+
+    assert asyncio.run(run()) == [(None, True), (None, True)]
@@ -1,6 +1,11 @@
+import asyncio
+import json
 import re
+import socket
+from datetime import datetime, timezone
 
 import pytest
+from websockets.exceptions import ConnectionClosedError
 
 from ocpp16_min import common
 
@@ -8,8 +13,17 @@ from ocpp16_min import common
 def test_make_call_and_result() -> None:
     call = common.make_call("uid-1", "BootNotification", {"a": 1})
     result = common.make_call_result("uid-1", {"ok": True})
-    assert call == [2, "uid-1", "BootNotification", {"a": 1}]
-    assert result == [3, "uid-1", {"ok": True}]
+    assert call == (2, "uid-1", "BootNotification", {"a": 1})
+    assert result == (3, "uid-1", {"ok": True})
+
+
+def test_checks_accept_built_frames() -> None:
+    call = common.make_heartbeat_call("uid-1")
+    result = common.make_call_result("uid-1", {"ok": True})
+    assert common.is_call(call)
+    assert common.validate_call(call) == ("uid-1", "Heartbeat", {})
+    assert common.is_call_result(result)
+    assert common.parse_call_result_payload(result) == {"ok": True}
 
 
 def test_new_uid_hex() -> None:
@@ -54,6 +68,18 @@ def test_validate_call_errors(expected: str, msg: object) -> None:
     assert expected in str(excinfo.value)
 
 
+def test_parse_call() -> None:
+    assert common.parse_call(b'[2,"u1","Heartbeat",{}]') == ("u1", "Heartbeat", {})
+    with pytest.raises(common.CallFormatError) as excinfo:
+        common.parse_call('[2,"u1","Heartbeat","nope"]')
+    assert excinfo.value.uid == "u1"
+    with pytest.raises(common.CallFormatError) as excinfo:
+        common.parse_call("[2,7]")
+    assert excinfo.value.uid is None
+    with pytest.raises(json.JSONDecodeError):
+        common.parse_call("[2,")
+
+
 def test_make_heartbeat_call_default_uid() -> None:
     msg = common.make_heartbeat_call()
     assert msg[0] == 2
@@ -86,3 +112,180 @@ def test_parse_call_result_payload() -> None:
         common.parse_call_result_payload([2, "u", "Heartbeat", {}])
     with pytest.raises(ValueError):
         common.parse_call_result_payload([3, "u", "nope"])
+
+
+def test_parse_message_accepts_bytes() -> None:
+    assert common.parse_message(b'[3, "u", {}]') == [3, "u", {}]
+
+
+def test_parse_message_invalid_raises_json_decode_error() -> None:
+    with pytest.raises(json.JSONDecodeError):
+        common.parse_message("not json")
+
+
+def test_dumps_bytes_round_trip() -> None:
+    frame = common.make_call("u1", "Heartbeat", {})
+    encoded = common.dumps_bytes(frame)
+    assert isinstance(encoded, bytes)
+    assert common.parse_message(encoded) == list(frame)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_bytes_encodes_datetimes(monkeypatch, use_orjson: bool) -> None:
+    if not use_orjson:
+        monkeypatch.setattr(common, "orjson", None)
+    elif common.orjson is None:
+        pytest.skip("orjson not installed")
+    value = datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)
+    assert common.dumps_bytes({"t": value}) == b'{"t":"%b"}' % value.isoformat().encode()
+
+
+@pytest.mark.parametrize(
+    "encode,make,kwargs",
+    [
+        (common.encode_heartbeat_call, common.make_heartbeat_call, {}),
+        (
+            common.encode_status_notification_call,
+            common.make_status_notification_call,
+            {"connector_id": 1, "status": "Available", "error_code": "NoError"},
+        ),
+        (
+            common.encode_start_transaction_call,
+            common.make_start_transaction_call,
+            {"connector_id": 1, "id_tag": 'TAG"1', "meter_start": 5, "timestamp": "2024-01-01T00:00:00Z"},
+        ),
+        (
+            common.encode_stop_transaction_call,
+            common.make_stop_transaction_call,
+            {"transaction_id": 7, "meter_stop": 100, "timestamp": "2024-01-01T00:00:00Z", "reason": "Local"},
+        ),
+    ],
+)
+def test_encode_call_matches_make_call(encode, make, kwargs) -> None:
+    uid, frame = encode(uid="uid-1", **kwargs)
+    expected = list(make(uid="uid-1", **kwargs))
+    decoded = common.parse_message(frame)
+    if "timestamp" in expected[3] and "timestamp" not in kwargs:
+        decoded[3]["timestamp"] = expected[3]["timestamp"]
+    assert uid == "uid-1"
+    assert decoded == expected
+
+
+def test_encode_heartbeat_call_generates_uid() -> None:
+    uid, frame = common.encode_heartbeat_call()
+    assert re.fullmatch(r"[0-9a-f]{32}", uid)
+    assert common.parse_message(frame) == [2, uid, "Heartbeat", {}]
+
+
+def test_utc_now_iso_z_format() -> None:
+    text = common.utc_now_iso_z()
+    assert re.fullmatch(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z", text)
+    assert common.parse_iso_z(text, "timestamp").tzinfo is not None
+
+
+def test_tune_tcp_socket_sets_nodelay() -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        common.tune_tcp_socket(sock)
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY) != 0
+    common.tune_tcp_socket(None)
+
+
+@pytest.mark.skipif(not hasattr(socket, "TCP_CORK"), reason="TCP_CORK is Linux-only")
+def test_corked_sets_and_clears_cork() -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        with common.corked(sock):
+            assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_CORK) != 0
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_CORK) == 0
+    with common.corked(None):
+        pass
+
+
+@pytest.mark.parametrize("transaction_id", [None, 7])
+def test_encode_meter_values_call_matches_make_call(transaction_id) -> None:
+    template = common.meter_values_template(connector_id=1, transaction_id=transaction_id)
+    uid, frame = common.encode_meter_values_call(template, 300, uid="uid-1", timestamp="2024-01-01T00:00:00Z")
+    expected = common.make_meter_values_call(
+        uid="uid-1",
+        connector_id=1,
+        transaction_id=transaction_id,
+        energy_wh=300,
+        timestamp="2024-01-01T00:00:00Z",
+    )
+    assert uid == "uid-1"
+    assert common.parse_message(frame) == list(expected)
+
+
+def test_encode_call_results_match_make_call_result() -> None:
+    uid = 'uid-"1"'
+    assert common.parse_message(common.encode_empty_call_result(uid)) == [3, uid, {}]
+    frame = common.encode_heartbeat_call_result(uid, current_time="2024-01-01T00:00:00Z")
+    assert common.parse_message(frame) == list(common.make_call_result(uid, {"currentTime": "2024-01-01T00:00:00Z"}))
+
+
+@pytest.mark.parametrize(
+    "frame,expected",
+    [
+        ('[3,"u",{}]', 3),
+        (b'[4,"u","NotSupported","",{}]', 4),
+        (b'[2,"u","Reset",{}]', 2),
+        ('[ 3, "u", {}]', 0),
+        (b"DUMP_STATE", 0),
+        ("", 0),
+    ],
+)
+def test_quick_msg_type(frame, expected: int) -> None:
+    assert common.quick_msg_type(frame) == expected
+
+
+def test_parse_iso_z() -> None:
+    expected = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert common.parse_iso_z("2024-01-02T03:04:05Z", "timestamp") == expected
+    assert common.parse_iso_z("2024-01-02T03:04:05+00:00", "timestamp") == expected
+    for bad in (
+        "2024-13-02T03:04:05Z",
+        "2024-01-02T03:04:61Z",
+        "+024-01-02T03:04:05Z",
+        "2024-01-02T 3:04:05Z",
+        "2_24-01-02T03:04:05Z",
+        "\u0662\u0660\u0662\u0664-01-02T03:04:05Z",
+        "nope",
+        "",
+    ):
+        with pytest.raises(ValueError):
+            common.parse_iso_z(bad, "timestamp")
+
+
+class _RecordingWebSocket:
+    def __init__(self, fail_after: int | None = None) -> None:
+        self.sent: list[tuple[bytes, bool]] = []
+        self.fail_after = fail_after
+
+    async def send(self, frame: bytes, text: bool = False) -> None:
+        if self.fail_after is not None and len(self.sent) >= self.fail_after:
+            raise ConnectionClosedError(None, None)
+        self.sent.append((frame, text))
+
+
+def test_send_queued_frames_sends_backlog_as_text() -> None:
+    async def run() -> _RecordingWebSocket:
+        websocket = _RecordingWebSocket()
+        outbox: asyncio.Queue[bytes] = asyncio.Queue()
+        for frame in (b"[1]", b"[2]", b"[3]"):
+            outbox.put_nowait(frame)
+        await common.send_queued_frames(websocket, outbox, None)
+        await asyncio.wait_for(outbox.join(), 1)
+        return websocket
+
+    assert asyncio.run(run()).sent == [(b"[1]", True), (b"[2]", True), (b"[3]", True)]
+
+
+def test_send_queued_frames_propagates_close_and_marks_done() -> None:
+    async def run() -> None:
+        outbox: asyncio.Queue[bytes] = asyncio.Queue()
+        outbox.put_nowait(b"[1]")
+        outbox.put_nowait(b"[2]")
+        with pytest.raises(ConnectionClosedError):
+            await common.send_queued_frames(_RecordingWebSocket(fail_after=1), outbox, None)
+        await asyncio.wait_for(outbox.join(), 1)
+
+    asyncio.run(run())
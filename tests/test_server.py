@@ -0,0 +1,178 @@
+import asyncio
+
+import fastjsonschema
+import pytest
+import websockets
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from ocpp16_min import server
+
+TIMESTAMP = "2024-01-02T03:04:05Z"
+METER_VALUE = {"timestamp": TIMESTAMP, "sampledValue": [{"value": "100"}]}
+CHARGING_PROFILE = {
+    "chargingProfileId": 1,
+    "stackLevel": 1,
+    "chargingProfilePurpose": "TxProfile",
+    "chargingProfileKind": "Absolute",
+    "chargingSchedule": {"chargingRateUnit": "W", "chargingSchedulePeriod": [{"limit": 7000}]},
+}
+
+
+@pytest.mark.parametrize(
+    "action,payload",
+    [
+        ("BootNotification", {"chargePointVendor": "RalphCo", "chargePointModel": "RalphModel1"}),
+        ("Heartbeat", {}),
+        ("StatusNotification", {"connectorId": 0, "status": "Available", "errorCode": "NoError"}),
+        ("StartTransaction", {"connectorId": 1, "idTag": "TEST", "meterStart": 0, "timestamp": TIMESTAMP}),
+        ("StartTransaction", {"connectorId": 1, "idTag": "TEST", "meterStart": "0", "timestamp": TIMESTAMP}),
+        ("StopTransaction", {"transactionId": 1, "meterStop": 200, "timestamp": TIMESTAMP}),
+        ("MeterValues", {"connectorId": 1, "transactionId": 1, "meterValue": [METER_VALUE]}),
+        (
+            "MeterValues",
+            {
+                "connectorId": 1,
+                "meterValue": [
+                    {
+                        "timestamp": TIMESTAMP,
+                        "sampledValue": [{"value": "100"}, {"value": "230.5", "measurand": "Voltage"}],
+                    },
+                    {"timestamp": TIMESTAMP, "sampledValue": [{"value": "not read"}]},
+                ],
+            },
+        ),
+        ("SetChargingProfile", {"connectorId": 1, "chargingProfile": CHARGING_PROFILE}),
+        (
+            "SetChargingProfile",
+            {
+                "chargingProfile": {
+                    **CHARGING_PROFILE,
+                    "chargingSchedule": {
+                        "chargingRateUnit": "W",
+                        "chargingSchedulePeriod": [{"limit": 7000}, {"startPeriod": 600}],
+                    },
+                }
+            },
+        ),
+        ("ClearChargingProfile", {"chargingProfileId": 1}),
+        ("ClearChargingProfile", {}),
+    ],
+)
+def test_validators_accept_valid_payloads(action, payload) -> None:
+    server._VALIDATORS[action](payload)
+
+
+@pytest.mark.parametrize(
+    "action,payload,description",
+    [
+        ("BootNotification", {"chargePointVendor": "RalphCo"}, "chargePointModel is required"),
+        ("BootNotification", {"chargePointVendor": 1, "chargePointModel": "M"}, "chargePointVendor must be a string"),
+        (
+            "StatusNotification",
+            {"connectorId": 2, "status": "Available", "errorCode": "NoError"},
+            "connectorId must be 0 or 1",
+        ),
+        (
+            "StatusNotification",
+            {"connectorId": 0, "status": "Faulted", "errorCode": "NoError"},
+            "status must be Available",
+        ),
+        (
+            "StartTransaction",
+            {"connectorId": 1, "idTag": "", "meterStart": 0, "timestamp": TIMESTAMP},
+            "idTag must be a non-empty string",
+        ),
+        (
+            "StartTransaction",
+            {"connectorId": 1, "idTag": "TEST", "meterStart": "abc", "timestamp": TIMESTAMP},
+            "meterStart must be an integer",
+        ),
+        (
+            "StartTransaction",
+            {"connectorId": 1, "idTag": "TEST", "meterStart": 1.5, "timestamp": TIMESTAMP},
+            "meterStart must be an integer",
+        ),
+        (
+            "StopTransaction",
+            {"transactionId": 1, "meterStop": 200, "timestamp": "yesterday"},
+            "timestamp must be ISO-8601",
+        ),
+        (
+            "StopTransaction",
+            {"transactionId": True, "meterStop": 200, "timestamp": TIMESTAMP},
+            "transactionId must be an integer",
+        ),
+        ("MeterValues", {"connectorId": 1, "meterValue": []}, "meterValue must be a non-empty list"),
+        (
+            "MeterValues",
+            {"connectorId": 1, "meterValue": [{"timestamp": TIMESTAMP, "sampledValue": [{}]}]},
+            "meterValue[0].sampledValue[0].value is required",
+        ),
+        (
+            "SetChargingProfile",
+            {
+                "chargingProfile": {
+                    **CHARGING_PROFILE,
+                    "chargingSchedule": {"chargingRateUnit": "W", "chargingSchedulePeriod": [{"limit": "7"}]},
+                }
+            },
+            "chargingProfile.chargingSchedule.chargingSchedulePeriod[0].limit must be a number",
+        ),
+        ("ClearChargingProfile", {"chargingProfileId": "x"}, "chargingProfileId must be an integer"),
+    ],
+)
+def test_validators_reject_invalid_payloads(action, payload, description) -> None:
+    with pytest.raises(fastjsonschema.JsonSchemaValueException) as excinfo:
+        server._VALIDATORS[action](payload)
+    assert server._describe_schema_error(excinfo.value) == description
+
+
+@pytest.mark.parametrize("offset,expected", [(0, 3), (2, 7), (3, 2)])
+def test_pin_to_cpu_walks_allowed_cpus(monkeypatch, offset, expected) -> None:
+    pinned = []
+    monkeypatch.setenv("PIN_CPU", "3")
+    monkeypatch.setattr(server.os, "sched_getaffinity", lambda pid: {2, 3, 5, 7}, raising=False)
+    monkeypatch.setattr(server.os, "sched_setaffinity", lambda pid, cpus: pinned.append(cpus), raising=False)
+    server.pin_to_cpu(offset)
+    assert pinned == [{expected}]
+
+
+def test_pin_to_cpu_rejects_disallowed_cpu(monkeypatch) -> None:
+    monkeypatch.setenv("PIN_CPU", "4")
+    monkeypatch.setattr(server.os, "sched_getaffinity", lambda pid: {2, 3, 5, 7}, raising=False)
+    monkeypatch.setattr(server.os, "sched_setaffinity", lambda pid, cpus: None, raising=False)
+    with pytest.raises(ValueError, match="PIN_CPU=4"):
+        server.pin_to_cpu()
+
+
+def test_rejected_frames_get_a_span_with_the_error(monkeypatch) -> None:
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(server, "_TRACING_ENABLED", True)
+    monkeypatch.setattr(server, "tracer", provider.get_tracer(__name__))
+    monkeypatch.setattr(server, "_sessions", {})
+    monkeypatch.setattr(server, "_state_summary_cache", {})
+    span_events = server.SpanEventHandler()
+    server.logger.addHandler(span_events)
+
+    async def run() -> None:
+        async with websockets.serve(server.handle_client, "127.0.0.1", 0) as ws_server:
+            port = ws_server.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}/CP_T") as websocket:
+                await websocket.send('[2,"h","Heartbeat",{}]')
+                await websocket.recv()
+                await websocket.send('[2,"u","Heartbeat"')
+                with pytest.raises(websockets.ConnectionClosed):
+                    await websocket.recv()
+                    await websocket.recv()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.logger.removeHandler(span_events)
+    spans = exporter.get_finished_spans()
+    assert [span.name for span in spans] == ["ws.message"]
+    assert spans[0].events[0].attributes["log.message"].startswith("Invalid JSON from CP_T")